@@ -0,0 +1,243 @@
+# batch_remediate.py
+"""
+Offline bulk remediation: walk a directory tree and push every .docx through the
+server.py pipeline (remediate_document) on a process pool, without HTTP.
+
+Remediated files are written to OUT_DIR mirroring the source tree, and one report
+row per file is appended to a JSONL or CSV report. A manifest of finished files
+(path, size, mtime) lets an interrupted run resume where it stopped; files that
+changed since they were processed are redone.
+
+Examples:
+    python batch_remediate.py /data/migration /data/remediated --report report.jsonl
+    python batch_remediate.py in/ out/ --report report.csv --workers 8 --no-detect
+"""
+import argparse
+import csv
+import json
+import os
+import signal
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from pathlib import Path
+from types import SimpleNamespace
+from typing import Dict, Any, Iterable, List, Optional
+
+HERE = Path(__file__).resolve().parent
+CSV_FIELDS = [
+    "path", "status", "output", "seconds", "bytesIn", "bytesOut", "fixed", "flagged",
+    "phasesSkipped", "suggestedFileName", "error",
+]
+
+_server = None
+
+
+# ---------- WORKER ----------
+def _init_worker():
+    global _server
+    # The pipeline prints debug lines per document; keep worker output off the progress display.
+    sys.stdout = open(os.devnull, "w")
+    signal.signal(signal.SIGINT, signal.SIG_IGN)  # the parent handles Ctrl-C and shuts the pool down
+    sys.path.insert(0, str(HERE))
+    import server
+    _server = server
+
+
+def process_one(src: str, dst: str, detect: bool) -> Dict[str, Any]:
+    """Remediate one file; returns a report row (never raises, errors are reported per file)."""
+    t0 = time.perf_counter()
+    row: Dict[str, Any] = {"output": None, "bytesIn": 0, "bytesOut": 0}
+    try:
+        original_bytes = Path(src).read_bytes()
+        row["bytesIn"] = len(original_bytes)
+        final_bytes, report = _server.remediate_document(original_bytes, Path(src).name, detect)
+        _server.process_file_name(SimpleNamespace(filename=Path(src).name), report)
+
+        out = Path(dst)
+        out.parent.mkdir(parents=True, exist_ok=True)
+        tmp = out.with_name(out.name + ".part")
+        tmp.write_bytes(final_bytes)
+        os.replace(tmp, out)  # never leave a half-written output behind
+
+        row.update({
+            "status": "ok",
+            "output": str(out),
+            "bytesOut": len(final_bytes),
+            "fixed": report["summary"]["fixed"],
+            "flagged": report["summary"]["flagged"],
+            "phasesSkipped": bool(report["fingerprint"] and report["fingerprint"]["phasesSkipped"]),
+            "suggestedFileName": report["suggestedFileName"],
+            "report": report,
+        })
+    except Exception as e:
+        row.update({"status": "error", "error": f"{type(e).__name__}: {e}"})
+    row["seconds"] = round(time.perf_counter() - t0, 3)
+    return row
+
+
+# ---------- MANIFEST / REPORT ----------
+def load_manifest(path: Path) -> Dict[str, Dict[str, Any]]:
+    """Latest manifest entry per relative path; a truncated last line (crash mid-write) is ignored."""
+    done: Dict[str, Dict[str, Any]] = {}
+    if not path.exists():
+        return done
+    with path.open() as f:
+        for line in f:
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                continue
+            done[entry["path"]] = entry
+    return done
+
+
+def _ends_with_newline(path: Path) -> bool:
+    with path.open("rb") as f:
+        f.seek(-1, os.SEEK_END)
+        return f.read(1) == b"\n"
+
+
+class ReportWriter:
+    def __init__(self, path: Path, fmt: str):
+        self.fmt = fmt
+        new = not path.exists() or path.stat().st_size == 0
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self.f = path.open("a", newline="")
+        if fmt == "csv":
+            self.csv = csv.DictWriter(self.f, fieldnames=CSV_FIELDS, extrasaction="ignore")
+            if new:
+                self.csv.writeheader()
+
+    def write(self, row: Dict[str, Any]):
+        if self.fmt == "csv":
+            self.csv.writerow(row)
+        else:
+            self.f.write(json.dumps(row) + "\n")
+        self.f.flush()
+
+    def close(self):
+        self.f.close()
+
+
+def _fmt_eta(seconds: float) -> str:
+    if seconds == float("inf"):
+        return "--"
+    m, s = divmod(int(seconds), 60)
+    h, m = divmod(m, 60)
+    return f"{h}h{m:02d}m" if h else f"{m}m{s:02d}s"
+
+
+# ---------- MAIN ----------
+def discover(src_dir: Path, pattern: str, exclude: Iterable[Path] = ()) -> List[Path]:
+    """Files under src_dir matching pattern, minus anything at or under an `exclude` path
+    (the output tree and manifest, when they live inside the source tree)."""
+    exclude = [e.resolve() for e in exclude]
+    return [
+        p for p in src_dir.rglob(pattern)
+        # Skip Word's "~$name.docx" lock files.
+        if p.is_file() and not p.name.startswith("~$")
+        and not any(p.resolve() == e or e in p.resolve().parents for e in exclude)
+    ]
+
+
+def run(args) -> int:
+    src_dir = Path(args.src).resolve()
+    out_dir = Path(args.out).resolve()
+    report_path = Path(args.report)
+    fmt = args.format or ("csv" if report_path.suffix.lower() == ".csv" else "jsonl")
+    manifest_path = Path(args.manifest) if args.manifest else out_dir / ".batch-manifest.jsonl"
+    if out_dir == src_dir:
+        print("OUT must differ from SRC; remediated files would overwrite the originals", file=sys.stderr)
+        return 2
+    out_dir.mkdir(parents=True, exist_ok=True)
+
+    done = load_manifest(manifest_path)
+    todo = []
+    skipped = 0
+    # OUT may sit inside SRC; never pick up earlier outputs (or the manifest) as new input.
+    for path in discover(src_dir, args.pattern, exclude=[out_dir, manifest_path, report_path]):
+        rel = path.relative_to(src_dir).as_posix()
+        st = path.stat()
+        prev = done.get(rel)
+        if prev and prev["status"] == "ok" and prev["size"] == st.st_size and prev["mtimeNs"] == st.st_mtime_ns:
+            skipped += 1
+            continue
+        todo.append((rel, path, st))
+    # Largest first, so one huge file does not end up running alone at the tail of the run.
+    todo.sort(key=lambda t: t[2].st_size, reverse=True)
+
+    total_bytes = sum(st.st_size for _, _, st in todo)
+    print(f"{len(todo)} to process ({total_bytes / 1e6:.1f} MB), {skipped} already done, "
+          f"{args.workers} workers", file=sys.stderr)
+    if not todo:
+        return 0
+
+    report = ReportWriter(report_path, fmt)
+    manifest = manifest_path.open("a")
+    if manifest.tell() and not _ends_with_newline(manifest_path):
+        manifest.write("\n")  # finish a line truncated by a crash, or the next entry would be glued to it
+    t0 = time.perf_counter()
+    finished = failed = bytes_done = 0
+    pool = ProcessPoolExecutor(max_workers=args.workers, initializer=_init_worker)
+    try:
+        futures = {
+            pool.submit(process_one, str(path), str(out_dir / rel), not args.no_detect): (rel, st)
+            for rel, path, st in todo
+        }
+        for fut in as_completed(futures):
+            rel, st = futures[fut]
+            try:
+                row = {"path": rel, **fut.result()}
+            except Exception as e:  # e.g. a worker killed by the OOM killer breaks the pool
+                row = {"path": rel, "status": "error", "output": None, "error": f"{type(e).__name__}: {e}"}
+            if args.summary_only:
+                row.pop("report", None)
+            report.write(row)
+            manifest.write(json.dumps({
+                "path": rel, "size": st.st_size, "mtimeNs": st.st_mtime_ns,
+                "status": row["status"], "output": row["output"],
+            }) + "\n")
+            manifest.flush()
+            os.fsync(manifest.fileno())
+
+            finished += 1
+            failed += row["status"] != "ok"
+            bytes_done += st.st_size
+            elapsed = time.perf_counter() - t0
+            rate = bytes_done / elapsed if elapsed else 0.0
+            eta = (total_bytes - bytes_done) / rate if rate else float("inf")
+            print(f"\r[{finished}/{len(todo)}] {finished / elapsed:.2f} docs/s  {rate / 1e6:.2f} MB/s  "
+                  f"errors {failed}  ETA {_fmt_eta(eta)}   ", end="", file=sys.stderr, flush=True)
+    except KeyboardInterrupt:
+        print("\nInterrupted; finished files are recorded in the manifest, rerun to resume.", file=sys.stderr)
+        return 130
+    finally:
+        pool.shutdown(wait=True, cancel_futures=True)
+        report.close()
+        manifest.close()
+
+    elapsed = time.perf_counter() - t0
+    print(f"\nDone: {finished} files in {elapsed:.1f}s ({finished / elapsed:.2f} docs/s), {failed} errors",
+          file=sys.stderr)
+    return 1 if failed else 0
+
+
+def main(argv: Optional[List[str]] = None):
+    ap = argparse.ArgumentParser(description="Remediate every .docx under a directory tree, in parallel.")
+    ap.add_argument("src", help="source directory (walked recursively)")
+    ap.add_argument("out", help="output directory; mirrors the source tree")
+    ap.add_argument("--report", required=True, help="report file, appended to; .csv or .jsonl")
+    ap.add_argument("--format", choices=["jsonl", "csv"], help="report format (default: from --report suffix)")
+    ap.add_argument("--manifest", help="resume manifest (default: OUT/.batch-manifest.jsonl)")
+    ap.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    ap.add_argument("--pattern", default="*.docx")
+    ap.add_argument("--no-detect", action="store_true", help="skip Phase C detections (remediate only)")
+    ap.add_argument("--summary-only", action="store_true",
+                    help="leave the full per-file report out of JSONL rows")
+    args = ap.parse_args(argv)
+    sys.exit(run(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,155 @@
+# docx_delta.py
+"""
+Delta packages for remediated .docx files.
+
+Remediation usually rewrites a handful of small XML parts (styles, settings,
+core properties) while media can make up 100+ MB of the package. A delta
+carries only the parts whose content changed, plus a manifest:
+
+    manifest.json
+        format / version
+        base.parts     {name: {"crc32", "size"}} for every part of the original
+        changed        names of replaced or added parts, in package order
+        removed        names of original parts that are dropped
+        result         {"sha256", "size"} of the rebuilt package and its
+                       {name: {"crc32", "size"}} "parts", in package order
+    parts/<name>       new content of each changed part
+
+Both the server and clients rebuild packages with `rebuild_package`, which is
+deterministic (original member order and zip metadata are kept), so a client
+holding the original can reproduce the server's output with `apply_docx_delta`.
+The result is verified part by part against the manifest's CRCs, which do not
+depend on the deflate implementation; the SHA-256 only matches byte-for-byte
+when the client's zlib compresses exactly like the server's. Standard library
+only, so clients can vendor this file.
+"""
+import copy
+import hashlib
+import json
+from io import BytesIO
+from typing import Dict, Any, Iterable, List
+from zipfile import ZipFile, ZipInfo, ZIP_DEFLATED
+
+DELTA_FORMAT = "docx-delta"
+DELTA_VERSION = 2
+DELTA_MEDIA_TYPE = "application/vnd.docx-delta+zip"
+MANIFEST_NAME = "manifest.json"
+PARTS_PREFIX = "parts/"
+NEW_PART_DATE_TIME = (1980, 1, 1, 0, 0, 0)
+
+
+class DeltaError(ValueError):
+    """The delta cannot be applied to the given original, or the result does not verify."""
+
+
+def rebuild_package(original_bytes: bytes, parts: Dict[str, bytes], removed: Iterable[str] = ()) -> bytes:
+    """
+    Build a new zip from original_bytes with `parts` replaced (or appended, if new) and `removed` dropped.
+    Replaced members keep the original member's position and zip metadata; new members are appended
+    in `parts` order with a fixed timestamp, so the output depends only on the inputs.
+    Every kept member, media included, is still decompressed and deflated again (zipfile cannot
+    copy compressed data as is), so this costs time in proportion to the whole package.
+    """
+    removed = set(removed)
+    out = BytesIO()
+    with ZipFile(BytesIO(original_bytes), "r") as zin, ZipFile(out, "w", ZIP_DEFLATED) as zout:
+        seen = set()
+        for info in zin.infolist():
+            if info.filename in removed:
+                continue
+            seen.add(info.filename)
+            content = parts[info.filename] if info.filename in parts else zin.read(info.filename)
+            zout.writestr(copy.copy(info), content)
+        for name, content in parts.items():
+            if name in seen:
+                continue
+            info = ZipInfo(name, date_time=NEW_PART_DATE_TIME)
+            info.compress_type = ZIP_DEFLATED
+            zout.writestr(info, content)
+    return out.getvalue()
+
+
+def part_index(package_bytes: bytes) -> Dict[str, Dict[str, int]]:
+    """{name: {"crc32", "size"}} for every member, read from the zip central directory only."""
+    with ZipFile(BytesIO(package_bytes), "r") as zf:
+        return {i.filename: {"crc32": i.CRC, "size": i.file_size} for i in zf.infolist()}
+
+
+def build_delta(original_bytes: bytes, final_bytes: bytes) -> bytes:
+    """
+    Encode final_bytes as a delta against original_bytes.
+    final_bytes must have been produced by `rebuild_package` from the same original,
+    otherwise `apply_docx_delta` cannot reproduce its member order.
+    """
+    base = part_index(original_bytes)
+    result_parts = part_index(final_bytes)
+    changed: Dict[str, bytes] = {}
+    with ZipFile(BytesIO(final_bytes), "r") as zf:
+        for name, entry in result_parts.items():
+            if base.get(name) != entry:
+                changed[name] = zf.read(name)
+    manifest = {
+        "format": DELTA_FORMAT,
+        "version": DELTA_VERSION,
+        "base": {"parts": base},
+        "changed": list(changed),
+        "removed": [name for name in base if name not in result_parts],
+        "result": {
+            "sha256": hashlib.sha256(final_bytes).hexdigest(),
+            "size": len(final_bytes),
+            "parts": result_parts,
+        },
+    }
+    out = BytesIO()
+    with ZipFile(out, "w", ZIP_DEFLATED) as zout:
+        zout.writestr(MANIFEST_NAME, json.dumps(manifest, indent=2))
+        for name, content in changed.items():
+            zout.writestr(PARTS_PREFIX + name, content)
+    return out.getvalue()
+
+
+def read_delta_manifest(delta_bytes: bytes) -> Dict[str, Any]:
+    with ZipFile(BytesIO(delta_bytes), "r") as zd:
+        manifest = json.loads(zd.read(MANIFEST_NAME))
+    if manifest.get("format") != DELTA_FORMAT or manifest.get("version") != DELTA_VERSION:
+        raise DeltaError(f"Unsupported delta format: {manifest.get('format')!r} v{manifest.get('version')!r}")
+    return manifest
+
+
+def apply_docx_delta(original_bytes: bytes, delta_bytes: bytes, verify_sha256: bool = False) -> bytes:
+    """
+    Rebuild the remediated .docx from the original package and a delta from /download-document.
+    Raises DeltaError if the original does not match the manifest's base part CRCs, if a changed
+    part fails its CRC, or if the rebuilt package's members, order or CRCs differ from the
+    manifest's result parts. The result SHA-256 is informational: it only matches when this
+    zlib deflates exactly like the server's, so it is checked only with verify_sha256=True.
+    """
+    manifest = read_delta_manifest(delta_bytes)
+    actual = part_index(original_bytes)
+    expected = manifest["base"]["parts"]
+    if actual != expected:
+        mismatched: List[str] = sorted(
+            name for name in set(actual) | set(expected) if actual.get(name) != expected.get(name)
+        )
+        raise DeltaError(f"Original does not match the delta base; differing parts: {mismatched[:20]}")
+
+    parts: Dict[str, bytes] = {}
+    with ZipFile(BytesIO(delta_bytes), "r") as zd:
+        for name in manifest["changed"]:
+            parts[name] = zd.read(PARTS_PREFIX + name)  # zipfile checks each member's CRC on read
+
+    rebuilt = rebuild_package(original_bytes, parts, manifest["removed"])
+    rebuilt_parts = part_index(rebuilt)
+    result_parts = manifest["result"]["parts"]
+    if list(rebuilt_parts.items()) != list(result_parts.items()):
+        mismatched = [
+            name for name in list(result_parts) + [n for n in rebuilt_parts if n not in result_parts]
+            if rebuilt_parts.get(name) != result_parts.get(name)
+        ]
+        detail = f"differing parts: {mismatched[:20]}" if mismatched else "member order differs"
+        raise DeltaError(f"Rebuilt package does not match the delta result; {detail}")
+    if verify_sha256:
+        digest = hashlib.sha256(rebuilt).hexdigest()
+        if digest != manifest["result"]["sha256"]:
+            raise DeltaError(f"Rebuilt package SHA-256 {digest} != expected {manifest['result']['sha256']}")
+    return rebuilt
@@ -0,0 +1,446 @@
+# loadtest.py
+"""
+Load-test harness for the remediation server.
+
+Drives /upload-document and /download-document with a weighted mix of
+documents over a concurrency ramp and reports, for every concurrency level,
+throughput, p50/p95/p99 latency, error rate and peak RSS as JSON.
+
+By default the ASGI `app` from server.py is driven in-process (no sockets);
+pass --url to target a running uvicorn instead (and --server-pid to sample
+that process' RSS). Every request then comes from one client, so start that
+server with CLIENT_RATE_PER_MIN=0 CLIENT_MB_PER_MIN=0 or the per-client limits
+answer most of the ramp with 429s.
+
+Examples:
+    python loadtest.py --concurrency 1,2,4,8 --duration 15 --out load.json
+    python loadtest.py --doc ../tests/fixtures --doc "synthetic:paragraphs=3000,tables=30,images=8@2"
+    CLIENT_RATE_PER_MIN=0 CLIENT_MB_PER_MIN=0 uvicorn server:app &
+    python loadtest.py --url http://127.0.0.1:8000 --server-pid 12345
+"""
+import argparse
+import asyncio
+import contextlib
+import http.client
+import io
+import json
+import os
+import platform
+import random
+import struct
+import subprocess
+import sys
+import threading
+import time
+import uuid
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Dict, Any, List, Optional, Tuple
+from urllib.parse import urlsplit
+
+HERE = Path(__file__).resolve().parent
+DEFAULT_FIXTURES = HERE.parent / "tests" / "fixtures"
+DOCX_MIME = "application/vnd.openxmlformats-officedocument.wordprocessingml.document"
+
+DEFAULT_DOCS = [
+    str(DEFAULT_FIXTURES),
+    "synthetic:paragraphs=40",
+    "synthetic:paragraphs=2000,tables=20,images=4",
+]
+
+
+# ---------- DOCUMENT MIX ----------
+def _noise_png(kb: int, seed: int) -> bytes:
+    """A valid RGB PNG of roughly `kb` kilobytes of incompressible pixels."""
+    side = max(8, int((kb * 1024 / 3) ** 0.5))
+    rng = random.Random(seed)
+    raw = b"".join(b"\x00" + rng.randbytes(side * 3) for _ in range(side))
+
+    def chunk(tag: bytes, data: bytes) -> bytes:
+        return struct.pack(">I", len(data)) + tag + data + struct.pack(">I", zlib.crc32(tag + data) & 0xFFFFFFFF)
+
+    ihdr = struct.pack(">IIBBBBB", side, side, 8, 2, 0, 0, 0)
+    return b"\x89PNG\r\n\x1a\n" + chunk(b"IHDR", ihdr) + chunk(b"IDAT", zlib.compress(raw, 1)) + chunk(b"IEND", b"")
+
+
+def synthetic_docx(paragraphs: int = 40, tables: int = 0, rows: int = 6, cols: int = 4,
+                   images: int = 0, image_kb: int = 256, seed: int = 0) -> bytes:
+    """
+    Generate a .docx with headings, body text, tables and images.
+    Every 10th paragraph is a heading; some runs get small/serif fonts so the
+    remediation transforms have work to do.
+    """
+    from docx import Document
+    from docx.shared import Pt, Inches
+
+    rng = random.Random(seed)
+    words = ("accessible document remediation heading table contrast shadow font "
+             "language title link paragraph review figure caption summary").split()
+    doc = Document()
+    for i in range(paragraphs):
+        if i % 10 == 0:
+            doc.add_heading(f"Section {i // 10 + 1}", level=1 + (i // 10) % 3)
+            continue
+        p = doc.add_paragraph()
+        run = p.add_run(" ".join(rng.choice(words) for _ in range(rng.randint(8, 40))))
+        if i % 7 == 0:
+            run.font.size = Pt(8)
+            run.font.name = "Times New Roman"
+    for t in range(tables):
+        table = doc.add_table(rows=rows, cols=cols)
+        for r, row in enumerate(table.rows):
+            for c, cell in enumerate(row.cells):
+                cell.text = "" if (r + c + t) % 5 == 0 else f"R{r}C{c}"
+    for i in range(images):
+        doc.add_picture(io.BytesIO(_noise_png(image_kb, seed * 1000 + i)), width=Inches(2))
+    out = io.BytesIO()
+    doc.save(out)
+    return out.getvalue()
+
+
+def parse_doc_spec(spec: str) -> Tuple[str, float]:
+    """Split 'SOURCE@WEIGHT' into (source, weight); weight defaults to 1."""
+    source, sep, weight = spec.rpartition("@")
+    if not sep:
+        return spec, 1.0
+    return source, float(weight)
+
+
+def load_documents(specs: List[str]) -> List[Dict[str, Any]]:
+    """
+    Resolve doc specs into [{name, data, weight}].
+    A SOURCE is a .docx file, a directory (all .docx files in it, sharing the
+    weight), or 'synthetic:key=value,...' (see synthetic_docx for keys).
+    """
+    docs = []
+    for spec in specs:
+        source, weight = parse_doc_spec(spec)
+        if source.startswith("synthetic:"):
+            params = {}
+            for pair in filter(None, source[len("synthetic:"):].split(",")):
+                key, _, value = pair.partition("=")
+                params[key.strip()] = int(value)
+            docs.append({"name": source, "data": synthetic_docx(**params), "weight": weight})
+            continue
+        path = Path(source)
+        files = sorted(path.glob("*.docx")) if path.is_dir() else [path]
+        if not files:
+            raise SystemExit(f"No .docx files found for {source!r}")
+        for f in files:
+            docs.append({"name": f.name, "data": f.read_bytes(), "weight": weight / len(files)})
+    return docs
+
+
+# ---------- HTTP DRIVERS ----------
+def disable_client_limits():
+    """Turn off per-client admission limits for a server imported in this process.
+
+    All in-process requests come from one client; measure the pipeline, not per-client limits.
+    Must run before `import server`, which reads these settings at import time.
+    """
+    os.environ.setdefault("CLIENT_RATE_PER_MIN", "0")
+    os.environ.setdefault("CLIENT_MB_PER_MIN", "0")
+
+
+def encode_multipart(filename: str, data: bytes) -> Tuple[bytes, str]:
+    boundary = uuid.uuid4().hex
+    body = (
+        f"--{boundary}\r\n"
+        f'Content-Disposition: form-data; name="file"; filename="{filename}"\r\n'
+        f"Content-Type: {DOCX_MIME}\r\n\r\n"
+    ).encode() + data + f"\r\n--{boundary}--\r\n".encode()
+    return body, f"multipart/form-data; boundary={boundary}"
+
+
+class InProcessClient:
+    """Calls an ASGI app directly, without a server or sockets."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def post(self, path: str, body: bytes, content_type: str) -> Tuple[int, int]:
+        status, content = await self.fetch(path, body, content_type)
+        return status, len(content)
+
+    async def fetch(self, path: str, body: bytes, content_type: str) -> Tuple[int, bytes]:
+        """POST and return (status, response body)."""
+        scope = {
+            "type": "http",
+            "asgi": {"version": "3.0"},
+            "http_version": "1.1",
+            "method": "POST",
+            "scheme": "http",
+            "path": path,
+            "raw_path": path.encode(),
+            "query_string": b"",
+            "root_path": "",
+            "headers": [
+                (b"host", b"loadtest"),
+                (b"content-type", content_type.encode()),
+                (b"content-length", str(len(body)).encode()),
+            ],
+            "client": ("127.0.0.1", 0),
+            "server": ("loadtest", 80),
+        }
+        sent = False
+        status = 0
+        chunks = []
+
+        async def receive():
+            nonlocal sent
+            if not sent:
+                sent = True
+                return {"type": "http.request", "body": body, "more_body": False}
+            await asyncio.Event().wait()  # block until cancelled, like a live connection
+
+        async def send(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            elif message["type"] == "http.response.body":
+                chunks.append(message.get("body", b""))
+
+        await self.app(scope, receive, send)
+        return status, b"".join(chunks)
+
+    async def close(self):
+        pass
+
+
+class RemoteClient:
+    """Blocking http.client requests against a running server, one thread per in-flight request."""
+
+    def __init__(self, url: str, max_workers: int):
+        parts = urlsplit(url)
+        self.host = parts.hostname or "127.0.0.1"
+        self.port = parts.port or (443 if parts.scheme == "https" else 80)
+        self.https = parts.scheme == "https"
+        self.prefix = parts.path.rstrip("/")
+        self.pool = ThreadPoolExecutor(max_workers=max_workers)
+
+    def _post(self, path: str, body: bytes, content_type: str) -> Tuple[int, int]:
+        conn_cls = http.client.HTTPSConnection if self.https else http.client.HTTPConnection
+        conn = conn_cls(self.host, self.port, timeout=600)
+        try:
+            conn.request("POST", self.prefix + path, body=body, headers={"Content-Type": content_type})
+            resp = conn.getresponse()
+            return resp.status, len(resp.read())
+        finally:
+            conn.close()
+
+    async def post(self, path: str, body: bytes, content_type: str) -> Tuple[int, int]:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.pool, self._post, path, body, content_type)
+
+    async def close(self):
+        self.pool.shutdown(wait=False)
+
+
+# ---------- MEASUREMENT ----------
+def read_rss_bytes(pid: int) -> Optional[int]:
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    if pid == os.getpid():
+        import resource
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if sys.platform == "darwin" else peak * 1024
+    return None
+
+
+class RssSampler:
+    """Samples a process' RSS on a background thread and keeps the peak."""
+
+    def __init__(self, pid: int, interval: float = 0.05):
+        self.pid = pid
+        self.interval = interval
+        self.peak: Optional[int] = None
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self):
+        while not self._stop.is_set():
+            rss = read_rss_bytes(self.pid)
+            if rss is not None and (self.peak is None or rss > self.peak):
+                self.peak = rss
+            self._stop.wait(self.interval)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+
+
+def percentile(sorted_values: List[float], q: float) -> Optional[float]:
+    """Linear-interpolated percentile of an already sorted list."""
+    if not sorted_values:
+        return None
+    k = (len(sorted_values) - 1) * q / 100.0
+    lo = int(k)
+    hi = min(lo + 1, len(sorted_values) - 1)
+    return sorted_values[lo] + (sorted_values[hi] - sorted_values[lo]) * (k - lo)
+
+
+def summarize(samples: List[Dict[str, Any]], elapsed: float) -> Dict[str, Any]:
+    latencies = sorted(s["ms"] for s in samples)
+    errors = sum(1 for s in samples if s["error"])
+    return {
+        "requests": len(samples),
+        "errors": errors,
+        "errorRate": round(errors / len(samples), 4) if samples else 0.0,
+        "throughputRps": round(len(samples) / elapsed, 3) if elapsed else 0.0,
+        "uploadMBps": round(sum(s["bytes"] for s in samples) / elapsed / 1e6, 3) if elapsed else 0.0,
+        "latencyMs": {
+            "mean": round(sum(latencies) / len(latencies), 2) if latencies else None,
+            "p50": _round(percentile(latencies, 50)),
+            "p95": _round(percentile(latencies, 95)),
+            "p99": _round(percentile(latencies, 99)),
+            "max": _round(latencies[-1] if latencies else None),
+        },
+    }
+
+
+def _round(v: Optional[float]) -> Optional[float]:
+    return round(v, 2) if v is not None else None
+
+
+# ---------- RUNNER ----------
+async def run_level(client, docs: List[Dict[str, Any]], endpoints: List[str], concurrency: int,
+                    duration: float, rng: random.Random) -> Tuple[List[Dict[str, Any]], float]:
+    weights = [d["weight"] for d in docs]
+    # Pre-encode bodies so the client-side cost stays out of the measurement.
+    bodies = [encode_multipart(d["name"] if d["name"].endswith(".docx") else "synthetic.docx", d["data"]) for d in docs]
+    samples: List[Dict[str, Any]] = []
+    deadline = time.perf_counter() + duration
+
+    async def worker(wid: int):
+        n = 0
+        while time.perf_counter() < deadline:
+            i = rng.choices(range(len(docs)), weights=weights)[0]
+            endpoint = endpoints[(wid + n) % len(endpoints)]
+            n += 1
+            body, ctype = bodies[i]
+            t0 = time.perf_counter()
+            try:
+                status, _ = await client.post(endpoint, body, ctype)
+                error = status >= 400
+            except Exception as e:
+                status, error = repr(e), True
+            samples.append({
+                "endpoint": endpoint,
+                "doc": docs[i]["name"],
+                "bytes": len(docs[i]["data"]),
+                "status": status,
+                "error": error,
+                "ms": (time.perf_counter() - t0) * 1000,
+            })
+
+    t0 = time.perf_counter()
+    await asyncio.gather(*(worker(w) for w in range(concurrency)))
+    return samples, time.perf_counter() - t0
+
+
+async def run(args) -> Dict[str, Any]:
+    docs = load_documents(args.doc or DEFAULT_DOCS)
+    levels = [int(c) for c in args.concurrency.split(",")]
+    endpoints = ["/" + e.strip().lstrip("/") for e in args.endpoints.split(",")]
+    rng = random.Random(args.seed)
+
+    if args.url:
+        client = RemoteClient(args.url, max_workers=max(levels))
+        rss_pid = args.server_pid
+    else:
+        sys.path.insert(0, str(HERE))
+        # The same documents are sent over and over; without this, detections after the first
+        # request of each document would be served from the findings cache and not measured.
+        os.environ.setdefault("FINDINGS_CACHE_SIZE", "0")
+        disable_client_limits()
+        import server
+        client = InProcessClient(server.app)
+        rss_pid = os.getpid()
+
+    results = []
+    try:
+        if args.warmup > 0:
+            await run_level(client, docs, endpoints, 1, args.warmup, rng)
+        for c in levels:
+            with RssSampler(rss_pid) if rss_pid else contextlib.nullcontext() as sampler:
+                samples, elapsed = await run_level(client, docs, endpoints, c, args.duration, rng)
+            level = {"concurrency": c, "durationSec": round(elapsed, 3), **summarize(samples, elapsed)}
+            level["peakRssMB"] = round(sampler.peak / 2**20, 1) if sampler and sampler.peak else None
+            level["byEndpoint"] = {
+                e: summarize([s for s in samples if s["endpoint"] == e], elapsed) for e in endpoints
+            }
+            level["errorStatuses"] = sorted({str(s["status"]) for s in samples if s["error"]})
+            results.append(level)
+            if args.url and "429" in level["errorStatuses"]:
+                print(f"warning: c={c} was throttled (429); start the server with "
+                      "CLIENT_RATE_PER_MIN=0 CLIENT_MB_PER_MIN=0 to measure the pipeline", file=sys.stderr)
+            print(f"c={c:<4} {level['throughputRps']:>8.2f} req/s  p50={level['latencyMs']['p50']}ms "
+                  f"p99={level['latencyMs']['p99']}ms  err={level['errorRate']:.2%}  "
+                  f"rss={level['peakRssMB']}MB", file=sys.stderr)
+    finally:
+        await client.close()
+
+    return {
+        "meta": {
+            "commit": git_commit(),
+            "timestamp": int(time.time()),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "mode": "remote" if args.url else "in-process",
+            "target": args.url or "server:app",
+            "endpoints": endpoints,
+            "durationSec": args.duration,
+            "seed": args.seed,
+            "documents": [{"name": d["name"], "bytes": len(d["data"]), "weight": round(d["weight"], 4)} for d in docs],
+        },
+        "levels": results,
+    }
+
+
+def git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], cwd=HERE, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except Exception:
+        return None
+
+
+def main(argv: Optional[List[str]] = None):
+    ap = argparse.ArgumentParser(description="Load-test /upload-document and /download-document.")
+    ap.add_argument("--doc", action="append",
+                    help="SOURCE[@WEIGHT]; a .docx, a directory or 'synthetic:paragraphs=N,tables=N,images=N,image_kb=N'. Repeatable.")
+    ap.add_argument("--endpoints", default="upload-document,download-document")
+    ap.add_argument("--concurrency", default="1,2,4,8", help="comma-separated ramp")
+    ap.add_argument("--duration", type=float, default=10.0, help="seconds per concurrency level")
+    ap.add_argument("--warmup", type=float, default=2.0, help="seconds of single-client warmup")
+    ap.add_argument("--seed", type=int, default=1)
+    ap.add_argument("--url", help="base URL of a running server; default drives server:app in-process")
+    ap.add_argument("--server-pid", type=int, help="pid to sample RSS from in --url mode")
+    ap.add_argument("--out", help="write JSON results here instead of stdout")
+    ap.add_argument("--verbose", action="store_true", help="keep the server's own stdout logging")
+    args = ap.parse_args(argv)
+
+    # The server prints per-request debug lines; keep them out of in-process timings.
+    quiet = not args.verbose and not args.url
+    with contextlib.redirect_stdout(open(os.devnull, "w")) if quiet else contextlib.nullcontext():
+        result = asyncio.run(run(args))
+
+    payload = json.dumps(result, indent=2)
+    if args.out:
+        Path(args.out).write_text(payload)
+    else:
+        print(payload)
+
+
+if __name__ == "__main__":
+    main()
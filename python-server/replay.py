@@ -0,0 +1,372 @@
+# replay.py
+"""
+Golden-corpus replay: run a directory of real documents through two versions of
+the pipeline and diff what changed.
+
+For every document both versions get /upload-document and /download-document
+(driven in-process). The summary reports:
+  - behavior changes: HTTP status, report fields, and output part hashes
+  - per-rule timing: each remediation/detection function's time, min over --repeat runs
+  - peak memory: tracemalloc peak per document, and each worker's max RSS
+
+A VERSION is a git ref (its python-server/ tree is exported to a temp dir) or a
+path to a directory containing server.py; each version runs in its own
+subprocess so their imports and memory never mix.
+
+Examples:
+    python replay.py                                  # HEAD vs working tree
+    python replay.py --baseline origin/main --candidate HEAD --out replay.json
+    python replay.py --corpus /data/golden --repeat 5 --slowdown 1.1
+"""
+import argparse
+import asyncio
+import contextlib
+import functools
+import hashlib
+import io
+import json
+import os
+import resource
+import subprocess
+import sys
+import tarfile
+import tempfile
+import time
+import tracemalloc
+import zipfile
+from pathlib import Path
+from typing import Dict, Any, List, Optional
+
+HERE = Path(__file__).resolve().parent
+REPO = HERE.parent
+DEFAULT_CORPUS = [REPO / "tests" / "fixtures", REPO / "Accessibility Standards"]
+
+# Functions timed in each version when present; names missing from a version are skipped.
+RULES = [
+    "remove_protection_bytes",
+    "remove_text_shadow_bytes",
+    "enforce_sans_serif_and_min_size_bytes",
+    "set_default_lang_en_us_bytes",
+    "ensure_title_bytes",
+    "set_table_header_repeat",
+    "detect_empty_headings_and_order",
+    "detect_contrast",
+    "detect_links",
+    "detect_tables_merged_empty",
+    "detect_header_footer",
+    "detect_media_and_gifs",
+    "Document",
+    "write_pkg_xml",
+    "rebuild_package",
+    "read_fingerprint",
+    "stamp_fingerprint",
+]
+
+
+# ---------- WORKER (runs inside one version) ----------
+def _instrument(server, timings: Dict[str, Dict[str, float]]):
+    """Wrap RULES in `server` with timers. Module-level registries holding the
+    original function objects (e.g. DETECTORS) are patched too."""
+    wrapped = {}
+    for name in RULES:
+        fn = getattr(server, name, None)
+        if not callable(fn):
+            continue
+
+        def timed(*args, __fn=fn, __name=name, **kwargs):
+            t0 = time.perf_counter()
+            try:
+                return __fn(*args, **kwargs)
+            finally:
+                entry = timings.setdefault(__name, {"ms": 0.0, "calls": 0})
+                entry["ms"] += (time.perf_counter() - t0) * 1000
+                entry["calls"] += 1
+
+        functools.update_wrapper(timed, fn)
+        setattr(server, name, timed)
+        wrapped[id(fn)] = timed
+    for attr, value in vars(server).items():
+        if isinstance(value, list):
+            for i, item in enumerate(value):
+                if isinstance(item, tuple) and any(id(x) in wrapped for x in item):
+                    value[i] = tuple(wrapped.get(id(x), x) for x in item)
+
+
+def _reset_caches(server):
+    cache = getattr(server, "FINDINGS_CACHE", None)
+    if cache is not None:
+        cache.entries.clear()
+
+
+def part_hashes(package: bytes) -> Dict[str, str]:
+    with zipfile.ZipFile(io.BytesIO(package)) as zf:
+        return {name: hashlib.sha256(zf.read(name)).hexdigest()[:16] for name in zf.namelist()}
+
+
+async def _replay_doc(client, encode_multipart, path: Path) -> Dict[str, Any]:
+    body, ctype = encode_multipart(path.name, path.read_bytes())
+    out: Dict[str, Any] = {}
+    for endpoint in ("/upload-document", "/download-document"):
+        t0 = time.perf_counter()
+        try:
+            status, content = await client.fetch(endpoint, body, ctype)
+            error = None
+        except Exception as e:  # in-process, unhandled errors propagate instead of becoming 500s
+            status, content, error = 500, b"", f"{type(e).__name__}: {e}"
+        result: Dict[str, Any] = {"status": status, "ms": round((time.perf_counter() - t0) * 1000, 2)}
+        if error:
+            result["error"] = error
+        elif endpoint == "/upload-document":
+            result["report"] = json.loads(content) if status == 200 else content.decode(errors="replace")[:500]
+        elif status == 200:
+            result["sha256"] = hashlib.sha256(content).hexdigest()
+            result["parts"] = part_hashes(content)
+        else:
+            result["body"] = content.decode(errors="replace")[:500]
+        out[endpoint.strip("/")] = result
+    return out
+
+
+def run_worker(version_dir: str, corpus: List[str], repeat: int, out_path: str):
+    sys.path.insert(0, str(HERE))
+    from loadtest import InProcessClient, disable_client_limits, encode_multipart  # this tool's tree, not the version's
+    sys.path.insert(0, version_dir)
+    disable_client_limits()
+    import server
+
+    timings: Dict[str, Dict[str, float]] = {}
+    _instrument(server, timings)
+    client = InProcessClient(server.app)
+    docs = sorted({
+        (f"{Path(d).name}/{p.relative_to(d).as_posix()}", p)
+        for d in corpus for p in Path(d).rglob("*.docx") if not p.name.startswith("~$")
+    })
+    if docs:
+        asyncio.run(_replay_doc(client, encode_multipart, docs[0][1]))  # warm imports and caches before timing
+    results = {}
+    for key, path in docs:
+        runs = []
+        for _ in range(repeat):
+            _reset_caches(server)
+            timings.clear()
+            outcome = asyncio.run(_replay_doc(client, encode_multipart, path))
+            runs.append((outcome, {k: dict(v) for k, v in timings.items()}))
+        # Memory pass, separate so tracemalloc's overhead stays out of the timings.
+        _reset_caches(server)
+        tracemalloc.start()
+        asyncio.run(_replay_doc(client, encode_multipart, path))
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+        outcome = runs[0][0]
+        for endpoint in ("upload-document", "download-document"):
+            outcome[endpoint]["ms"] = min(r[0][endpoint]["ms"] for r in runs)
+        rules = {}
+        for name in {n for _, t in runs for n in t}:
+            rules[name] = {
+                "ms": round(min(t.get(name, {"ms": 0.0})["ms"] for _, t in runs), 3),
+                "calls": runs[0][1].get(name, {"calls": 0})["calls"],
+            }
+        outcome["rules"] = rules
+        outcome["peakAllocMB"] = round(peak / 2**20, 2)
+        outcome["bytes"] = path.stat().st_size
+        results[key] = outcome
+
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    Path(out_path).write_text(json.dumps({
+        "versionDir": version_dir,
+        "maxRssMB": round(peak_rss / (2**20 if sys.platform == "darwin" else 2**10), 1),
+        "documents": results,
+    }))
+
+
+# ---------- VERSIONS ----------
+def resolve_version(spec: str, workdir: Path) -> str:
+    """A path containing server.py, or a git ref whose python-server/ tree is exported to workdir."""
+    path = Path(spec)
+    if path.is_file() and path.name == "server.py":
+        return str(path.resolve().parent)
+    if (path / "server.py").is_file():
+        return str(path.resolve())
+    archive = subprocess.run(
+        ["git", "archive", "--format=tar", spec, "python-server"],
+        cwd=REPO, capture_output=True, check=False,
+    )
+    if archive.returncode != 0:
+        raise SystemExit(f"Cannot resolve version {spec!r}: {archive.stderr.decode().strip()}")
+    dest = workdir / spec.replace("/", "_")
+    with tarfile.open(fileobj=io.BytesIO(archive.stdout)) as tar:
+        tar.extractall(dest)
+    return str(dest / "python-server")
+
+
+def run_version(version_dir: str, corpus: List[str], repeat: int, workdir: Path, label: str) -> Dict[str, Any]:
+    out_path = workdir / f"{label}.json"
+    cmd = [sys.executable, str(Path(__file__).resolve()), "--worker", version_dir,
+           "--worker-out", str(out_path), "--repeat", str(repeat)]
+    for c in corpus:
+        cmd += ["--corpus", c]
+    print(f"replaying {label}: {version_dir}", file=sys.stderr)
+    # The server prints debug output per request; keep only the worker's stderr on failure.
+    proc = subprocess.run(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True)
+    if proc.returncode != 0:
+        raise SystemExit(f"{label} worker failed:\n{proc.stderr[-4000:]}")
+    return json.loads(out_path.read_text())
+
+
+# ---------- DIFF ----------
+def diff_values(a: Any, b: Any, path: str = "", out: Optional[List[Dict[str, Any]]] = None, limit: int = 50):
+    """Paths at which two JSON values differ (at most `limit`)."""
+    out = [] if out is None else out
+    if len(out) >= limit:
+        return out
+    if isinstance(a, dict) and isinstance(b, dict):
+        for k in sorted(set(a) | set(b), key=str):
+            diff_values(a.get(k, "<missing>"), b.get(k, "<missing>"), f"{path}.{k}" if path else str(k), out, limit)
+    elif isinstance(a, list) and isinstance(b, list) and len(a) == len(b):
+        for i, (x, y) in enumerate(zip(a, b)):
+            diff_values(x, y, f"{path}[{i}]", out, limit)
+    elif a != b:
+        out.append({"path": path, "baseline": a, "candidate": b})
+    return out
+
+
+def compare(base: Dict[str, Any], cand: Dict[str, Any], slowdown: float, min_ms: float) -> Dict[str, Any]:
+    behavior, slowdowns, speedups, memory, failing = [], [], [], [], []
+    rule_totals: Dict[str, Dict[str, float]] = {}
+    docs_b, docs_c = base["documents"], cand["documents"]
+    for doc in sorted(set(docs_b) | set(docs_c)):
+        if doc not in docs_b or doc not in docs_c:
+            continue
+        b, c = docs_b[doc], docs_c[doc]
+
+        changes = []
+        for endpoint in ("upload-document", "download-document"):
+            eb, ec = b[endpoint], c[endpoint]
+            if eb["status"] != ec["status"] or eb.get("error") != ec.get("error"):
+                changes.append({"endpoint": endpoint, "status": [eb["status"], ec["status"]],
+                                "error": [eb.get("error"), ec.get("error")]})
+        report_diff = diff_values(b["upload-document"].get("report"), c["upload-document"].get("report"))
+        if report_diff:
+            changes.append({"endpoint": "upload-document", "report": report_diff})
+        pb, pc = b["download-document"].get("parts", {}), c["download-document"].get("parts", {})
+        if pb != pc:
+            changes.append({
+                "endpoint": "download-document",
+                "partsAdded": sorted(set(pc) - set(pb)),
+                "partsRemoved": sorted(set(pb) - set(pc)),
+                "partsChanged": sorted(n for n in set(pb) & set(pc) if pb[n] != pc[n]),
+            })
+        if changes:
+            behavior.append({"doc": doc, "changes": changes})
+        for endpoint in ("upload-document", "download-document"):
+            if b[endpoint]["status"] >= 400 and c[endpoint]["status"] >= 400:
+                failing.append({"doc": doc, "endpoint": endpoint, "error": c[endpoint].get("error") or c[endpoint].get("body")})
+        if any(b[e]["status"] != c[e]["status"] for e in ("upload-document", "download-document")):
+            continue  # timings of a request that now fails (or now succeeds) are not comparable
+
+        timed = [(f"{e} (total)", b[e]["ms"], c[e]["ms"]) for e in ("upload-document", "download-document")]
+        for rule in sorted(set(b["rules"]) | set(c["rules"])):
+            rb = b["rules"].get(rule, {}).get("ms", 0.0)
+            rc = c["rules"].get(rule, {}).get("ms", 0.0)
+            timed.append((rule, rb, rc))
+            tot = rule_totals.setdefault(rule, {"baselineMs": 0.0, "candidateMs": 0.0})
+            tot["baselineMs"] += rb
+            tot["candidateMs"] += rc
+        for name, tb, tc in timed:
+            entry = {"doc": doc, "rule": name, "baselineMs": tb, "candidateMs": tc,
+                     "ratio": round(tc / tb, 2) if tb else None}
+            if tc - tb >= min_ms and (not tb or tc / tb >= slowdown):
+                slowdowns.append(entry)
+            elif tb - tc >= min_ms and tc and tb / tc >= slowdown:
+                speedups.append(entry)
+
+        mb, mc = b["peakAllocMB"], c["peakAllocMB"]
+        if mb and mc / mb >= slowdown and mc - mb >= 1.0:
+            memory.append({"doc": doc, "baselineMB": mb, "candidateMB": mc, "ratio": round(mc / mb, 2)})
+
+    return {
+        "documents": len(set(docs_b) & set(docs_c)),
+        "onlyInBaseline": sorted(set(docs_b) - set(docs_c)),
+        "onlyInCandidate": sorted(set(docs_c) - set(docs_b)),
+        "behaviorChanges": behavior,
+        "slowdowns": sorted(slowdowns, key=lambda e: e["candidateMs"] - e["baselineMs"], reverse=True),
+        "speedups": sorted(speedups, key=lambda e: e["baselineMs"] - e["candidateMs"], reverse=True),
+        "memoryRegressions": memory,
+        "failingInBoth": failing,
+        "ruleTotals": {k: {kk: round(vv, 2) for kk, vv in v.items()} for k, v in sorted(rule_totals.items())},
+        "maxRssMB": {"baseline": base["maxRssMB"], "candidate": cand["maxRssMB"]},
+    }
+
+
+def print_summary(result: Dict[str, Any], file=sys.stdout):
+    p = functools.partial(print, file=file)
+    p(f"Replayed {result['documents']} documents: {result['baseline']} -> {result['candidate']}")
+    p(f"\nBehavior changes: {len(result['behaviorChanges'])} document(s)")
+    for entry in result["behaviorChanges"]:
+        p(f"  {entry['doc']}")
+        for ch in entry["changes"]:
+            if "status" in ch:
+                p(f"    {ch['endpoint']}: status {ch['status'][0]} -> {ch['status'][1]}  {ch['error'][1] or ''}")
+            if "report" in ch:
+                for d in ch["report"][:10]:
+                    p(f"    report {d['path']}: {json.dumps(d['baseline'])[:60]} -> {json.dumps(d['candidate'])[:60]}")
+            if "partsChanged" in ch:
+                p(f"    parts changed {ch['partsChanged']} added {ch['partsAdded']} removed {ch['partsRemoved']}")
+    p(f"\nFailing in both versions: {len(result['failingInBoth'])}")
+    for e in result["failingInBoth"]:
+        p(f"  {e['doc']}: {e['endpoint']} {str(e['error'])[:100]}")
+    p(f"\nSlowdowns: {len(result['slowdowns'])}")
+    for e in result["slowdowns"][:20]:
+        p(f"  {e['doc']}: {e['rule']} {e['baselineMs']:.1f}ms -> {e['candidateMs']:.1f}ms (x{e['ratio']})")
+    p(f"\nSpeedups: {len(result['speedups'])}")
+    for e in result["speedups"][:10]:
+        p(f"  {e['doc']}: {e['rule']} {e['baselineMs']:.1f}ms -> {e['candidateMs']:.1f}ms (x{e['ratio']})")
+    p(f"\nMemory regressions: {len(result['memoryRegressions'])}")
+    for e in result["memoryRegressions"]:
+        p(f"  {e['doc']}: {e['baselineMB']}MB -> {e['candidateMB']}MB (x{e['ratio']})")
+    p("\nPer-rule totals (ms):")
+    for rule, t in result["ruleTotals"].items():
+        p(f"  {rule:<40} {t['baselineMs']:>10.1f} {t['candidateMs']:>10.1f}")
+    p(f"\nWorker max RSS (MB): {result['maxRssMB']['baseline']} -> {result['maxRssMB']['candidate']}")
+
+
+def main(argv: Optional[List[str]] = None):
+    ap = argparse.ArgumentParser(description="Replay a document corpus through two pipeline versions and diff them.")
+    ap.add_argument("--baseline", default="HEAD", help="git ref or directory with server.py (default: HEAD)")
+    ap.add_argument("--candidate", default=str(HERE), help="git ref or directory with server.py (default: working tree)")
+    ap.add_argument("--corpus", action="append", help="directory of .docx files, searched recursively. Repeatable.")
+    ap.add_argument("--repeat", type=int, default=3, help="timing runs per document; the minimum is kept")
+    ap.add_argument("--slowdown", type=float, default=1.25, help="ratio that counts as a slowdown/speedup")
+    ap.add_argument("--min-ms", type=float, default=5.0, help="ignore timing differences smaller than this")
+    ap.add_argument("--out", help="write the full JSON result here")
+    ap.add_argument("--fail-on", default="behavior", help="comma-separated: behavior, slowdown, memory, none")
+    ap.add_argument("--worker", help=argparse.SUPPRESS)
+    ap.add_argument("--worker-out", help=argparse.SUPPRESS)
+    args = ap.parse_args(argv)
+    corpus = args.corpus or [str(p) for p in DEFAULT_CORPUS]
+
+    if args.worker:
+        with contextlib.redirect_stdout(open(os.devnull, "w")):
+            run_worker(args.worker, corpus, args.repeat, args.worker_out)
+        return
+
+    with tempfile.TemporaryDirectory(prefix="replay-") as tmp:
+        workdir = Path(tmp)
+        base = run_version(resolve_version(args.baseline, workdir), corpus, args.repeat, workdir, "baseline")
+        cand = run_version(resolve_version(args.candidate, workdir), corpus, args.repeat, workdir, "candidate")
+    result = {"baseline": args.baseline, "candidate": args.candidate, "corpus": corpus,
+              **compare(base, cand, args.slowdown, args.min_ms)}
+    if args.out:
+        Path(args.out).write_text(json.dumps(result, indent=2))
+    print_summary(result)
+
+    fail_on = set(args.fail_on.split(","))
+    failed = (("behavior" in fail_on and result["behaviorChanges"])
+              or ("slowdown" in fail_on and result["slowdowns"])
+              or ("memory" in fail_on and result["memoryRegressions"]))
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
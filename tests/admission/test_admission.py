@@ -0,0 +1,124 @@
+"""
+Tests for per-client admission control and fair lane queuing (python-server/server.py,
+ADMISSION and SCHEDULING sections).
+
+Run with:  python -m pytest tests/admission
+"""
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+import server
+
+COST = {"cost": 1000, "memory": 1}
+
+
+@pytest.fixture
+def limits(monkeypatch):
+    monkeypatch.setattr(server, "CLIENT_RATE_PER_MIN", 6.0)
+    monkeypatch.setattr(server, "CLIENT_BURST", 2.0)
+    monkeypatch.setattr(server, "CLIENT_MB_PER_MIN", 512.0)
+    monkeypatch.setattr(server, "CLIENT_BURST_MB", 256.0)
+    return server.ClientRegistry()
+
+
+def test_client_over_its_request_budget_gets_429_with_retry_after(limits):
+    limits.charge("origin:https://a.example", COST)
+    limits.charge("origin:https://a.example", COST)
+    with pytest.raises(server.HTTPException) as exc:
+        limits.charge("origin:https://a.example", COST)
+
+    assert exc.value.status_code == 429
+    assert 1 <= int(exc.value.headers["Retry-After"]) <= 10
+    limits.charge("origin:https://b.example", COST)  # other clients are unaffected
+    assert limits.clients["origin:https://a.example"].rejected == 1
+
+
+def test_weight_scales_the_budget(limits, monkeypatch):
+    monkeypatch.setattr(server, "CLIENT_WEIGHTS", {"key:heavy": 2.0})
+    for _ in range(4):
+        limits.charge("key:heavy", COST)
+    with pytest.raises(server.HTTPException):
+        limits.charge("key:heavy", COST)
+
+
+def test_upload_bigger_than_the_bucket_needs_a_full_bucket(limits):
+    big = {"cost": 300 * 2**20, "memory": 1}
+    limits.charge("key:big-upload", big)
+    with pytest.raises(server.HTTPException) as exc:
+        limits.charge("key:big-upload", big)
+
+    assert int(exc.value.headers["Retry-After"]) == 36  # refill all 300 MB taken at 512 MB/min
+
+
+def test_light_client_overtakes_a_heavy_backlog():
+    async def scenario():
+        lane = server.Lane("test", concurrency=1, memory_budget=10)
+        order = []
+
+        async def job(client, n):
+            await lane.acquire(1, client, share=1.0)
+            order.append(f"{client}{n}")
+            await asyncio.sleep(0)
+            lane.release(1)
+
+        tasks = [asyncio.ensure_future(job("heavy", n)) for n in range(5)]
+        await asyncio.sleep(0)
+        tasks.append(asyncio.ensure_future(job("light", 0)))
+        await asyncio.gather(*tasks)
+        return order
+
+    order = asyncio.run(scenario())
+    assert order.index("light0") <= 2
+    assert [o for o in order if o.startswith("heavy")] == [f"heavy{n}" for n in range(5)]
+
+
+def request_with(**headers):
+    return SimpleNamespace(headers={k.replace("_", "-"): v for k, v in headers.items()},
+                           client=SimpleNamespace(host="10.0.0.1"))
+
+
+def test_session_ids_are_hashed_and_scoped_under_origin_or_address():
+    by_origin = server.client_key(request_with(origin="https://a.example", x_session_id="abc"))
+    by_address = server.client_key(request_with(x_session_id="abc"))
+
+    assert by_origin.startswith("origin:https://a.example|session:")
+    assert by_address.startswith("ip:10.0.0.1|session:")
+    assert "abc" not in by_origin + by_address
+    assert server.client_key(request_with(x_api_key="secret")) == "key:" + server._opaque("secret")
+
+
+def test_fresh_session_ids_share_their_parents_budget(limits):
+    origin = "origin:https://a.example"
+    for n in range(2):
+        limits.charge(f"{origin}|session:{n}", COST)
+    with pytest.raises(server.HTTPException) as exc:
+        limits.charge(f"{origin}|session:fresh", COST)
+
+    assert exc.value.status_code == 429
+    assert limits.clients[origin].admitted == 2
+    assert limits.clients[f"{origin}|session:0"].lane_key == origin
+    limits.charge("origin:https://b.example|session:0", COST)
+
+
+def test_registry_size_is_capped(limits, monkeypatch):
+    monkeypatch.setattr(server, "CLIENT_REGISTRY_MAX", 3)
+    limits.get("origin:https://a.example").active = 1  # in flight: never evicted
+    for n in range(10):
+        limits.get(f"ip:10.0.0.{n}")
+
+    assert len(limits.clients) == 3
+    assert "origin:https://a.example" in limits.clients
+
+
+def test_operator_endpoints_are_closed_without_operator_token(monkeypatch):
+    monkeypatch.setattr(server, "OPERATOR_TOKEN", "")
+    with pytest.raises(server.HTTPException) as exc:
+        server.require_operator(request_with(x_operator_token=""))
+    assert exc.value.status_code == 403
+
+    monkeypatch.setattr(server, "OPERATOR_TOKEN", "s3cret")
+    with pytest.raises(server.HTTPException):
+        server.require_operator(request_with(x_operator_token="wrong"))
+    server.require_operator(request_with(x_operator_token="s3cret"))
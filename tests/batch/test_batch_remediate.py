@@ -0,0 +1,88 @@
+"""
+Tests for offline bulk remediation and its resume manifest (python-server/batch_remediate.py).
+
+Run with:  python -m pytest tests/batch
+"""
+import json
+import os
+import shutil
+from pathlib import Path
+from types import SimpleNamespace
+
+import batch_remediate
+
+SAMPLE = Path(__file__).resolve().parents[2] / "Accessibility Standards" / "Protected.docx"
+
+
+def batch(src: Path, out: Path, **overrides) -> int:
+    args = SimpleNamespace(src=str(src), out=str(out), report=str(out.parent / "report.jsonl"), format=None,
+                           manifest=None, workers=1, pattern="*.docx", no_detect=True, summary_only=True)
+    vars(args).update(overrides)
+    return batch_remediate.run(args)
+
+
+def processed(out: Path) -> list:
+    """Relative paths of every report row written so far, in order."""
+    report = out.parent / "report.jsonl"
+    return [json.loads(line)["path"] for line in report.read_text().splitlines()] if report.exists() else []
+
+
+def corpus(tmp_path: Path) -> Path:
+    src = tmp_path / "src"
+    (src / "sub").mkdir(parents=True)
+    shutil.copy(SAMPLE, src / "a.docx")
+    shutil.copy(SAMPLE, src / "sub" / "b.docx")
+    return src
+
+
+def test_rerun_skips_unchanged_files_and_redoes_changed_ones(tmp_path):
+    src, out = corpus(tmp_path), tmp_path / "out"
+    assert batch(src, out) == 0
+    assert sorted(processed(out)) == ["a.docx", "sub/b.docx"]
+    assert (out / "sub" / "b.docx").exists()
+
+    assert batch(src, out) == 0
+    assert len(processed(out)) == 2
+
+    st = (src / "a.docx").stat()
+    os.utime(src / "a.docx", ns=(st.st_atime_ns, st.st_mtime_ns + 10**9))  # touched, same size
+    with (src / "sub" / "b.docx").open("ab") as f:
+        f.write(b"\0")  # same mtime is not enough once the size differs
+    os.utime(src / "sub" / "b.docx", ns=(st.st_atime_ns, st.st_mtime_ns))
+    assert batch(src, out) == 0
+    assert sorted(processed(out)[2:]) == ["a.docx", "sub/b.docx"]
+
+
+def test_failed_files_are_retried_on_the_next_run(tmp_path):
+    src, out = corpus(tmp_path), tmp_path / "out"
+    (src / "broken.docx").write_bytes(b"not a zip")
+    assert batch(src, out) == 1
+
+    assert batch(src, out) == 1
+    assert processed(out)[3:] == ["broken.docx"]
+
+
+def test_truncated_last_manifest_line_is_ignored_and_not_extended(tmp_path):
+    src, out = corpus(tmp_path), tmp_path / "out"
+    batch(src, out)
+    manifest = out / ".batch-manifest.jsonl"
+    lines = manifest.read_text().splitlines()
+    manifest.write_text(lines[0] + "\n" + lines[1][: len(lines[1]) // 2])  # crash mid-write
+
+    assert batch(src, out) == 0
+    redone = processed(out)[2:]
+    assert redone == [json.loads(lines[1])["path"]]
+    assert set(batch_remediate.load_manifest(manifest)) == {"a.docx", "sub/b.docx"}
+    assert batch(src, out) == 0
+    assert len(processed(out)) == 3
+
+
+def test_output_inside_the_source_tree_is_not_picked_up_as_input(tmp_path):
+    src = corpus(tmp_path)
+    out = src / "remediated"
+    assert batch(src, out) == 0
+    assert (out / "a.docx").exists()
+
+    assert batch(src, out) == 0
+    assert sorted(processed(out)) == ["a.docx", "sub/b.docx"]
+    assert batch(src, src) == 2
@@ -0,0 +1,8 @@
+"""
+Shared pytest setup for the Python server tests: make python-server/ importable, so test
+modules can `import server` and `import docx_delta` directly.
+"""
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "python-server"))
@@ -0,0 +1,139 @@
+"""
+Tests for the delta download format (python-server/docx_delta.py).
+
+Run with:  python -m pytest tests/delta-download
+"""
+import io
+import json
+import random
+import zipfile
+import zlib
+from pathlib import Path
+
+import pytest
+
+from docx_delta import (
+    DeltaError,
+    apply_docx_delta,
+    build_delta,
+    read_delta_manifest,
+    rebuild_package,
+)
+
+ROOT = Path(__file__).resolve().parents[2]
+MEDIA = random.Random(0).randbytes(1 << 20)  # incompressible 1 MiB that must never travel in a delta
+
+
+def make_package() -> bytes:
+    out = io.BytesIO()
+    with zipfile.ZipFile(out, "w", zipfile.ZIP_DEFLATED) as z:
+        z.writestr("[Content_Types].xml", "<Types/>")
+        z.writestr("word/document.xml", "<w:document>body</w:document>")
+        z.writestr("word/styles.xml", "<w:styles>old</w:styles>")
+        z.writestr("word/settings.xml", "<w:settings><w:documentProtection/></w:settings>")
+        z.writestr("word/media/image1.png", MEDIA)
+        z.writestr("customXml/item1.xml", "<orphan/>")
+    return out.getvalue()
+
+
+def test_roundtrip_reproduces_final_package_exactly():
+    original = make_package()
+    final = rebuild_package(
+        original,
+        {"word/styles.xml": b"<w:styles>new</w:styles>", "docProps/custom.xml": b"<Properties/>"},
+        removed=["customXml/item1.xml"],
+    )
+    delta = build_delta(original, final)
+
+    assert apply_docx_delta(original, delta) == final
+    assert len(delta) < len(final) / 10
+
+
+def test_manifest_lists_only_changed_parts():
+    original = make_package()
+    final = rebuild_package(original, {
+        "word/styles.xml": b"<w:styles>new</w:styles>",
+        "word/settings.xml": b"<w:settings><w:documentProtection/></w:settings>",  # unchanged content
+    })
+    manifest = read_delta_manifest(build_delta(original, final))
+
+    assert manifest["changed"] == ["word/styles.xml"]
+    assert manifest["removed"] == []
+    assert set(manifest["base"]["parts"]) == set(zipfile.ZipFile(io.BytesIO(original)).namelist())
+    with zipfile.ZipFile(io.BytesIO(build_delta(original, final))) as zd:
+        assert "parts/word/media/image1.png" not in zd.namelist()
+
+
+def test_rebuild_keeps_member_order_and_appends_new_parts():
+    original = make_package()
+    final = rebuild_package(original, {"docProps/custom.xml": b"<Properties/>", "word/styles.xml": b"<x/>"})
+    names = zipfile.ZipFile(io.BytesIO(final)).namelist()
+
+    assert names == zipfile.ZipFile(io.BytesIO(original)).namelist() + ["docProps/custom.xml"]
+
+
+def test_rejects_a_different_original():
+    original = make_package()
+    final = rebuild_package(original, {"word/styles.xml": b"<w:styles>new</w:styles>"})
+    delta = build_delta(original, final)
+    other = rebuild_package(original, {"word/document.xml": b"<w:document>edited</w:document>"})
+
+    with pytest.raises(DeltaError, match="word/document.xml"):
+        apply_docx_delta(other, delta)
+
+
+def tamper_manifest(delta: bytes, edit) -> bytes:
+    manifest = read_delta_manifest(delta)
+    edit(manifest)
+    tampered = io.BytesIO()
+    with zipfile.ZipFile(io.BytesIO(delta)) as zd, zipfile.ZipFile(tampered, "w") as zt:
+        for info in zd.infolist():
+            data = zd.read(info.filename)
+            if info.filename == "manifest.json":
+                data = json.dumps(manifest)
+            zt.writestr(info.filename, data)
+    return tampered.getvalue()
+
+
+def test_result_hash_is_only_checked_on_request():
+    original = make_package()
+    final = rebuild_package(original, {"word/styles.xml": b"<w:styles>new</w:styles>"})
+    tampered = tamper_manifest(build_delta(original, final), lambda m: m["result"].update(sha256="0" * 64))
+
+    with pytest.raises(DeltaError, match="SHA-256"):
+        apply_docx_delta(original, tampered, verify_sha256=True)
+    assert apply_docx_delta(original, tampered) == final
+
+
+def test_rejects_a_result_whose_part_crcs_differ():
+    original = make_package()
+    final = rebuild_package(original, {"word/styles.xml": b"<w:styles>new</w:styles>"})
+    tampered = tamper_manifest(build_delta(original, final),
+                               lambda m: m["result"]["parts"]["word/styles.xml"].update(crc32=0))
+
+    with pytest.raises(DeltaError, match="word/styles.xml"):
+        apply_docx_delta(original, tampered)
+
+
+def test_a_different_deflate_still_verifies(monkeypatch):
+    original = make_package()
+    styles = "".join(f'<w:style w:styleId="S{i}"><w:name w:val="Style {i * 7919 % 1000}"/></w:style>' for i in range(500))
+    final = rebuild_package(original, {"word/styles.xml": f"<w:styles>{styles}</w:styles>".encode()})
+    delta = build_delta(original, final)
+    # A client whose zlib picks different matches: same content, different compressed bytes.
+    monkeypatch.setattr(zipfile, "_get_compressor", lambda *_: zlib.compressobj(1, zlib.DEFLATED, -15))
+
+    rebuilt = apply_docx_delta(original, delta)
+    assert rebuilt != final
+    with zipfile.ZipFile(io.BytesIO(rebuilt)) as a, zipfile.ZipFile(io.BytesIO(final)) as b:
+        assert [(n, a.read(n)) for n in a.namelist()] == [(n, b.read(n)) for n in b.namelist()]
+
+
+def test_remediated_document_roundtrip():
+    import server
+    original = (ROOT / "Accessibility Standards" / "Protected.docx").read_bytes()
+    final, _ = server.remediate_document(original, "Protected.docx", detect=False)
+    delta = build_delta(original, final)
+
+    assert "word/settings.xml" in read_delta_manifest(delta)["changed"]
+    assert apply_docx_delta(original, delta) == final
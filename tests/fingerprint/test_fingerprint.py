@@ -0,0 +1,120 @@
+"""
+Tests for the remediation fingerprint stamp (python-server/server.py, FINGERPRINT section).
+
+Run with:  python -m pytest tests/fingerprint
+"""
+import io
+import zipfile
+from pathlib import Path
+
+import pytest
+
+import server
+from docx_delta import rebuild_package
+
+ROOT = Path(__file__).resolve().parents[2]
+SAMPLE = ROOT / "Accessibility Standards" / "Protected.docx"
+
+
+def test_remediated_output_carries_a_valid_stamp():
+    final, report = server.remediate_document(SAMPLE.read_bytes(), SAMPLE.name)
+
+    stamp = server.read_fingerprint(final)
+    assert stamp == {"ruleset": server.RULESET_VERSION, "digest": report["fingerprint"]["digest"]}
+    assert report["fingerprint"]["phasesSkipped"] is False
+    with zipfile.ZipFile(io.BytesIO(final)) as zf:
+        assert b"docProps/custom.xml" in zf.read("_rels/.rels")
+        assert b"/docProps/custom.xml" in zf.read("[Content_Types].xml")
+
+
+def test_reupload_skips_phases_and_reproduces_the_report():
+    final, _ = server.remediate_document(SAMPLE.read_bytes(), SAMPLE.name)
+    again, fast = server.remediate_document(final, SAMPLE.name)
+
+    server.FINDINGS_CACHE.entries.clear()
+    full = server.new_report(SAMPLE.name)
+    server.run_phase_b(server.run_phase_a(final, full), full)
+    server.run_detections(final, full)
+
+    assert again is final
+    assert fast["fingerprint"]["phasesSkipped"] is True
+    assert fast["summary"] == full["summary"]
+    assert fast["details"] == full["details"]
+
+
+def test_edited_document_is_not_trusted():
+    final, _ = server.remediate_document(SAMPLE.read_bytes(), SAMPLE.name)
+    with zipfile.ZipFile(io.BytesIO(final)) as zf:
+        body = zf.read("word/document.xml")
+    edited = rebuild_package(final, {"word/document.xml": body.replace(b"</w:body>", b"<w:p/></w:body>")})
+
+    assert server.read_fingerprint(edited) is None
+    _, report = server.remediate_document(edited, SAMPLE.name)
+    assert report["fingerprint"]["phasesSkipped"] is False
+
+
+def test_stamp_from_another_ruleset_is_ignored(monkeypatch):
+    final, _ = server.remediate_document(SAMPLE.read_bytes(), SAMPLE.name)
+    monkeypatch.setattr(server, "RULESET_VERSION", server.RULESET_VERSION + "-next")
+
+    assert server.read_fingerprint(final) is None
+
+
+@pytest.mark.parametrize("value", ["[]", "1", '"stamp"', "null"])
+def test_stamp_that_is_not_an_object_is_ignored(value):
+    final, _ = server.remediate_document(SAMPLE.read_bytes(), SAMPLE.name)
+    with zipfile.ZipFile(io.BytesIO(final)) as zf:
+        custom = zf.read("docProps/custom.xml")
+    tampered = rebuild_package(final, {"docProps/custom.xml": server._set_fingerprint_property(custom, value)})
+
+    assert server.read_fingerprint(tampered) is None
+    _, report = server.remediate_document(tampered, SAMPLE.name)
+    assert report["fingerprint"]["phasesSkipped"] is False
+
+
+def test_malformed_pid_on_an_existing_property_is_tolerated():
+    custom = (
+        b'<Properties xmlns="http://schemas.openxmlformats.org/officeDocument/2006/custom-properties" '
+        b'xmlns:vt="http://schemas.openxmlformats.org/officeDocument/2006/docPropsVTypes">'
+        b'<property fmtid="{D5CDD505-2E9C-101B-9397-08002B2CF9AE}" pid="x" name="Other"><vt:lpwstr>v</vt:lpwstr></property>'
+        b'</Properties>'
+    )
+    stamped = server.etree.fromstring(server._set_fingerprint_property(custom, "{}"))
+
+    assert [p.get("pid") for p in stamped] == ["x", "2"]
+
+
+def _with_custom_props(custom_xml=None, register_rel=True):
+    """SAMPLE with a custom-properties Override, plus (optionally) the part and its relationship."""
+    with zipfile.ZipFile(io.BytesIO(SAMPLE.read_bytes())) as zf:
+        ct, rels = zf.read("[Content_Types].xml"), zf.read("_rels/.rels")
+    parts = {"[Content_Types].xml": ct.replace(
+        b"</Types>", b'<Override PartName="/docProps/custom.xml" ContentType="%s"/></Types>'
+        % server.CUSTOM_PROPS_CONTENT_TYPE.encode())}
+    if register_rel:
+        parts["_rels/.rels"] = rels.replace(
+            b"</Relationships>", b'<Relationship Id="rId9" Type="%s" Target="docProps/custom.xml"/></Relationships>'
+            % server.CUSTOM_PROPS_REL_TYPE.encode())
+    if custom_xml is not None:
+        parts["docProps/custom.xml"] = custom_xml
+    return rebuild_package(SAMPLE.read_bytes(), parts)
+
+
+def test_unparsable_custom_properties_skip_the_stamp_instead_of_failing():
+    broken = _with_custom_props(b"<Properties><property></Properties>")
+
+    final, report = server.remediate_document(broken, SAMPLE.name)
+
+    assert report["fingerprint"] is None
+    assert report["summary"]["fixed"] > 0
+    with zipfile.ZipFile(io.BytesIO(final)) as zf:
+        assert zf.read("docProps/custom.xml") == b"<Properties><property></Properties>"
+
+
+def test_existing_declarations_for_a_missing_custom_part_are_not_duplicated():
+    final, report = server.remediate_document(_with_custom_props(register_rel=False), SAMPLE.name)
+
+    assert server.read_fingerprint(final)["digest"] == report["fingerprint"]["digest"]
+    with zipfile.ZipFile(io.BytesIO(final)) as zf:
+        assert zf.read("[Content_Types].xml").count(b'PartName="/docProps/custom.xml"') == 1
+        assert zf.read("_rels/.rels").count(server.CUSTOM_PROPS_REL_TYPE.encode()) == 1
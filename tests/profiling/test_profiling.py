@@ -0,0 +1,87 @@
+"""
+Tests for the per-request profiling hook (python-server/server.py, PROFILING section).
+
+Run with:  python -m pytest tests/profiling
+"""
+import json
+import pstats
+from pathlib import Path
+from types import SimpleNamespace
+
+import pytest
+
+import server
+
+ROOT = Path(__file__).resolve().parents[2]
+SAMPLE = ROOT / "Accessibility Standards" / "Protected.docx"
+
+
+def test_profiled_run_writes_pstats_and_per_phase_summary(tmp_path, monkeypatch):
+    monkeypatch.setattr(server, "PROFILE_DIR", tmp_path)
+    server.FINDINGS_CACHE.entries.clear()
+    data = SAMPLE.read_bytes()
+    profiler = server.RequestProfiler("write", "header", SAMPLE.name, len(data))
+
+    final, report = profiler.run(data, SAMPLE.name)
+
+    assert final == server.remediate_document(data, SAMPLE.name)[0]
+    prof = next(tmp_path.glob("*-profile.prof"))
+    assert pstats.Stats(str(prof)).total_calls > 0
+    summary = json.loads(prof.with_suffix(".json").read_text())
+    assert {"fingerprint", "A", "B", "rebuild", "C"} <= set(summary["phases"])
+    assert summary["phases"]["B"]["topFunctions"]
+    assert summary["allocationsTracked"] is True and summary["phases"]["B"]["peakTracedMB"] > 0
+    assert any(s["phase"] == "B" and s["step"] == "removeTextShadows" for s in summary["steps"])
+    assert profiler.response_fields()["profile"]["files"] == [prof.name, prof.with_suffix(".json").name]
+
+
+def test_profile_header_is_operator_only(monkeypatch):
+    request = SimpleNamespace(headers={"x-profile": "inline"})
+    monkeypatch.setattr(server, "OPERATOR_TOKEN", "")
+    with pytest.raises(server.HTTPException) as exc:
+        server.profile_mode(request)
+    assert exc.value.status_code == 403
+
+    monkeypatch.setattr(server, "OPERATOR_TOKEN", "s3cret")
+    with pytest.raises(server.HTTPException):
+        server.profile_mode(request)
+    request.headers["x-operator-token"] = "s3cret"
+    assert server.profile_mode(request) == "inline"
+    assert server.profile_mode(SimpleNamespace(headers={})) is None
+
+
+def test_sampled_profiles_leave_allocation_tracing_off(tmp_path, monkeypatch):
+    monkeypatch.setattr(server, "PROFILE_DIR", tmp_path)
+    data = SAMPLE.read_bytes()
+    profiler = server.RequestProfiler("write", "sample", SAMPLE.name, len(data))
+    seen = []
+    original = server.remediate_document
+
+    def remediate(*args):
+        seen.append(server.tracemalloc.is_tracing())
+        return original(*args)
+
+    monkeypatch.setattr(server, "remediate_document", remediate)
+    profiler.run(data, SAMPLE.name)
+
+    assert seen == [False]
+    assert profiler.summary["allocationsTracked"] is False
+    assert profiler.summary["phases"]["B"]["topFunctions"]
+    assert profiler.summary["phases"]["B"]["topAllocations"] == []
+
+
+def test_written_profiles_are_capped_oldest_first(tmp_path, monkeypatch):
+    monkeypatch.setattr(server, "PROFILE_DIR", tmp_path)
+    monkeypatch.setattr(server, "PROFILE_MAX_FILES", 2)
+    for ms in (1000, 3000, 2000):
+        for suffix in (".prof", ".json"):
+            (tmp_path / f"{ms}-abc123-profile{suffix}").write_text("{}")
+    (tmp_path / "baseline-profile.json").write_text("{}")  # not ours: never swept
+    data = SAMPLE.read_bytes()
+    profiler = server.RequestProfiler("write", "header", SAMPLE.name, len(data))
+
+    profiler.run(data, SAMPLE.name)
+
+    assert sorted(p.name for p in tmp_path.iterdir()) == sorted(
+        profiler.files + ["3000-abc123-profile.json", "3000-abc123-profile.prof", "baseline-profile.json"]
+    )
@@ -0,0 +1,208 @@
+"""
+Tests for Server-Sent progress events and parked downloads (python-server/server.py,
+PROGRESS STREAMING section). The app is driven in-process over raw ASGI.
+
+Run with:  python -m pytest tests/progress-events
+"""
+import asyncio
+import json
+import time
+from pathlib import Path
+
+import pytest
+
+import server
+from docx_delta import apply_docx_delta
+
+ROOT = Path(__file__).resolve().parents[2]
+SAMPLE = ROOT / "Accessibility Standards" / "Protected.docx"
+DOCX_TYPE = "application/vnd.openxmlformats-officedocument.wordprocessingml.document"
+BOUNDARY = "----progress-events-test"
+
+
+@pytest.fixture(autouse=True)
+def isolated(monkeypatch, tmp_path):
+    monkeypatch.setattr(server, "DOWNLOAD_DIR", tmp_path)
+    monkeypatch.setattr(server, "CLIENTS", server.ClientRegistry())
+    monkeypatch.setitem(server.LANES, "fast", server.Lane("fast", 4, 2**30))
+    server.FINDINGS_CACHE.entries.clear()
+
+
+def multipart(data: bytes, file_name: str = SAMPLE.name, **fields) -> bytes:
+    body = b""
+    for name, value in fields.items():
+        body += f'--{BOUNDARY}\r\nContent-Disposition: form-data; name="{name}"\r\n\r\n{value}\r\n'.encode()
+    body += (f'--{BOUNDARY}\r\nContent-Disposition: form-data; name="file"; filename="{file_name}"\r\n'
+             f"Content-Type: {DOCX_TYPE}\r\n\r\n").encode() + data + f"\r\n--{BOUNDARY}--\r\n".encode()
+    return body
+
+
+async def call(method, path, body=b"", headers=None, disconnect_when=None):
+    """Run one request through the ASGI app; returns (status, headers, body).
+    `disconnect_when(message)` makes the client drop the connection after that send()."""
+    headers = {"host": "test", **(headers or {})}
+    if body:
+        headers.update({"content-type": f"multipart/form-data; boundary={BOUNDARY}", "content-length": str(len(body))})
+    scope = {
+        "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1", "method": method,
+        "scheme": "http", "path": path, "raw_path": path.encode(), "query_string": b"", "root_path": "",
+        "headers": [(k.encode(), v.encode()) for k, v in headers.items()],
+        "client": ("127.0.0.1", 0), "server": ("test", 80),
+    }
+    sent = False
+    disconnected = asyncio.Event()
+    response = {"status": 0, "headers": {}, "body": b""}
+
+    async def receive():
+        nonlocal sent
+        if not sent:
+            sent = True
+            return {"type": "http.request", "body": body, "more_body": False}
+        await disconnected.wait()
+        return {"type": "http.disconnect"}
+
+    async def send(message):
+        if message["type"] == "http.response.start":
+            response["status"] = message["status"]
+            response["headers"] = {k.decode(): v.decode() for k, v in message["headers"]}
+        elif message["type"] == "http.response.body":
+            response["body"] += message.get("body", b"")
+        if disconnect_when and disconnect_when(message):
+            disconnected.set()
+
+    await server.app(scope, receive, send)
+    return response["status"], response["headers"], response["body"]
+
+
+def request(*args, **kwargs):
+    return asyncio.run(call(*args, **kwargs))
+
+
+def parse_events(body: bytes):
+    events = []
+    for block in body.decode().split("\n\n"):
+        if block.strip() and not block.startswith(":"):
+            fields = dict(line.split(": ", 1) for line in block.split("\n"))
+            events.append((fields["event"], json.loads(fields["data"])))
+    return events
+
+
+def test_upload_streams_every_stage_then_the_report():
+    data = SAMPLE.read_bytes()
+    status, headers, body = request("POST", "/upload-document", multipart(data), {"accept": "text/event-stream"})
+
+    assert status == 200
+    assert headers["content-type"].startswith("text/event-stream")
+    events = parse_events(body)
+    progress = [d for e, d in events if e == "progress"]
+    assert progress[0] == {"phase": "received", "status": "end", "bytes": len(data), "elapsedMs": progress[0]["elapsedMs"]}
+    assert progress[1]["phase"] == "scheduled" and progress[1]["lane"] == "fast"
+    phases = [d["phase"] for d in progress]
+    assert [p for i, p in enumerate(phases) if p not in phases[:i]] == \
+        ["received", "scheduled", "fingerprint", "A", "B", "rebuild", "C"]
+    assert {d["step"] for d in progress if d["phase"] == "C"} >= {"headings", "contrast", "links", "tables", "headerFooter", "media"}
+    assert all(d["durationMs"] >= 0 for d in progress if d["status"] == "end" and "durationMs" in d)
+    elapsed = [d["elapsedMs"] for _, d in events]
+    assert elapsed == sorted(elapsed)
+
+    kind, complete = events[-1]
+    assert kind == "complete"
+    server.FINDINGS_CACHE.entries.clear()
+    _, _, plain = request("POST", "/upload-document", multipart(data))
+    assert complete["report"]["summary"] == json.loads(plain)["report"]["summary"]
+
+
+@pytest.mark.parametrize("mode", ["full", "delta"])
+def test_streamed_download_returns_a_handle_to_the_same_payload(mode):
+    data = SAMPLE.read_bytes()
+    _, _, body = request("POST", "/download-document", multipart(data, stream="true", mode=mode))
+    kind, complete = parse_events(body)[-1]
+    handle = complete["download"]
+
+    assert kind == "complete"
+    assert handle["url"] == f"{server.PUBLIC_BASE_URL}/downloads/{handle['token']}"
+    status, headers, fetched = request("GET", handle["path"], headers={"origin": server.allowed_origins[0]})
+    assert status == 200
+    assert headers["x-docx-sha256"] == handle["sha256"]
+    assert "X-Docx-SHA256" in headers["access-control-expose-headers"]  # readable from browser scripts
+    _, _, plain = request("POST", "/download-document", multipart(data, mode=mode))
+    if mode == "full":
+        assert fetched == plain
+    else:
+        assert apply_docx_delta(data, fetched) == apply_docx_delta(data, plain)
+
+
+def test_parked_downloads_expire_and_are_swept(monkeypatch, tmp_path):
+    _, _, body = request("POST", "/download-document", multipart(SAMPLE.read_bytes(), stream="true"))
+    token = parse_events(body)[-1][1]["download"]["token"]
+    assert request("GET", f"/downloads/{token}")[0] == 200
+
+    later = time.time() + server.DOWNLOAD_TTL_SEC + 1
+    monkeypatch.setattr(server, "now_ts", lambda: int(later))
+    assert request("GET", f"/downloads/{token}")[0] == 404
+    server.store_download({"body": b"x", "fileName": "x.docx", "mediaType": DOCX_TYPE, "headers": {"X-Docx-SHA256": ""}})
+    assert not list(tmp_path.glob(f"dl-{token}.*"))
+    assert request("GET", "/downloads/not-a-token")[0] == 404
+
+
+def test_failure_ends_the_stream_with_an_error_event(monkeypatch):
+    def broken(*args):
+        raise RuntimeError("boom")
+
+    monkeypatch.setattr(server, "remediate_document", broken)
+    _, _, body = request("POST", "/upload-document", multipart(SAMPLE.read_bytes(), stream="true"))
+    events = parse_events(body)
+
+    assert [e for e, _ in events] == ["progress", "progress", "error"]
+    assert events[-1][1]["status"] == 500
+    assert events[-1][1]["detail"]["message"] == "boom"
+
+
+def test_invalid_package_is_rejected_before_streaming():
+    status, headers, _ = request("POST", "/upload-document", multipart(b"not a zip", stream="true"))
+
+    assert status == 400
+    assert not headers["content-type"].startswith("text/event-stream")
+
+
+def test_keepalive_comments_while_a_stage_runs(monkeypatch):
+    monkeypatch.setattr(server, "SSE_KEEPALIVE_SEC", 0.01)
+    remediate = server.remediate_document
+
+    def slow(*args):
+        time.sleep(0.1)
+        return remediate(*args)
+
+    monkeypatch.setattr(server, "remediate_document", slow)
+    _, _, body = request("POST", "/upload-document", multipart(SAMPLE.read_bytes(), stream="true"))
+
+    assert b": keepalive\n\n" in body
+    assert parse_events(body)[-1][0] == "complete"
+
+
+def test_client_that_disconnects_while_queued_gives_up_its_place(monkeypatch):
+    lane = server.Lane("fast", 1, 2**30)
+    monkeypatch.setitem(server.LANES, "fast", lane)
+    calls = []
+    monkeypatch.setattr(server, "remediate_document", lambda *args: calls.append(args))
+
+    async def scenario():
+        await lane.acquire(1)  # the lane is busy, so the streamed request has to queue
+        first_event = lambda m: m["type"] == "http.response.body" and b"received" in m.get("body", b"")
+        status, _, body = await asyncio.wait_for(
+            call("POST", "/upload-document", multipart(SAMPLE.read_bytes(), stream="true"), disconnect_when=first_event), 5
+        )
+        for _ in range(5):
+            await asyncio.sleep(0)
+        queued = lane.stats()["queued"]
+        lane.release(1)
+        await asyncio.sleep(0.05)
+        return status, body, queued
+
+    status, body, queued = asyncio.run(scenario())
+    assert status == 200
+    assert [e for e, _ in parse_events(body)] == ["progress"]
+    assert queued == 0
+    assert calls == []
+    assert lane.active == 0
+    assert all(c.queued == 0 and c.active == 0 for c in server.CLIENTS.clients.values())
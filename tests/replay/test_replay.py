@@ -0,0 +1,122 @@
+"""
+Tests for the golden-corpus replay diff (python-server/replay.py), fed with synthetic worker outputs.
+
+Run with:  python -m pytest tests/replay
+"""
+import copy
+import io
+import types
+
+import replay
+
+
+def outcome(status=200, ms=100.0, rules=None, report=None, parts=None, error=None, peak=10.0):
+    """One document's worker output: both endpoints, per-rule timings and peak allocation."""
+    upload = {"status": status, "ms": ms, "report": report if report is not None else {"summary": {"fixed": 2}}}
+    download = {"status": status, "ms": ms, "parts": parts if parts is not None else {"word/document.xml": "aa"}}
+    if error:
+        upload["error"] = download["error"] = error
+    if status >= 400:
+        upload.pop("report")
+        download.pop("parts")
+        download["body"] = "invalid docx"
+    return {"upload-document": upload, "download-document": download,
+            "rules": {name: {"ms": v, "calls": 1} for name, v in (rules or {}).items()},
+            "peakAllocMB": peak, "bytes": 1000}
+
+
+def worker(documents, rss=100.0):
+    return {"versionDir": "/tmp/v", "maxRssMB": rss, "documents": documents}
+
+
+def diff(base_docs, cand_docs, slowdown=1.25, min_ms=5.0):
+    return replay.compare(worker(base_docs), worker(cand_docs), slowdown, min_ms)
+
+
+def test_identical_outputs_report_nothing():
+    docs = {"a.docx": outcome(rules={"detect_links": 12.0})}
+    result = diff(docs, copy.deepcopy(docs))
+
+    assert result["documents"] == 1
+    assert result["behaviorChanges"] == result["slowdowns"] == result["speedups"] == []
+    assert result["ruleTotals"] == {"detect_links": {"baselineMs": 12.0, "candidateMs": 12.0}}
+
+
+def test_behavior_changes_cover_status_report_and_parts():
+    base = {
+        "report.docx": outcome(report={"summary": {"fixed": 2}, "details": {"titleFixed": False}}),
+        "parts.docx": outcome(parts={"word/document.xml": "aa", "word/styles.xml": "bb"}),
+        "status.docx": outcome(rules={"detect_links": 10.0}),
+        "gone.docx": outcome(),
+    }
+    cand = {
+        "report.docx": outcome(report={"summary": {"fixed": 3}, "details": {"titleFixed": False}}),
+        "parts.docx": outcome(parts={"word/document.xml": "ac", "docProps/custom.xml": "cc"}),
+        "status.docx": outcome(status=500, error="KeyError: 'w:val'", rules={"detect_links": 900.0}),
+        "new.docx": outcome(),
+    }
+    result = diff(base, cand)
+    changes = {e["doc"]: e["changes"] for e in result["behaviorChanges"]}
+
+    assert changes["report.docx"] == [{"endpoint": "upload-document",
+                                       "report": [{"path": "summary.fixed", "baseline": 2, "candidate": 3}]}]
+    assert changes["parts.docx"] == [{"endpoint": "download-document", "partsAdded": ["docProps/custom.xml"],
+                                      "partsRemoved": ["word/styles.xml"], "partsChanged": ["word/document.xml"]}]
+    assert changes["status.docx"][0]["status"] == [200, 500]
+    assert changes["status.docx"][0]["error"] == [None, "KeyError: 'w:val'"]
+    assert not any(e["doc"] == "status.docx" for e in result["slowdowns"])  # a failing run's timing is not comparable
+    assert result["onlyInBaseline"] == ["gone.docx"] and result["onlyInCandidate"] == ["new.docx"]
+    assert result["documents"] == 3
+
+
+def test_slowdowns_need_both_the_ratio_and_the_minimum_difference():
+    base = {"a.docx": outcome(ms=100.0, rules={"detect_links": 10.0, "detect_contrast": 1.0, "ensure_title_bytes": 40.0,
+                                               "detect_tables_merged_empty": 30.0})}
+    cand = {"a.docx": outcome(ms=103.0, rules={"detect_links": 20.0, "detect_contrast": 4.0, "ensure_title_bytes": 46.0,
+                                               "detect_tables_merged_empty": 10.0})}
+    result = diff(base, cand, slowdown=1.25, min_ms=5.0)
+
+    assert [e["rule"] for e in result["slowdowns"]] == ["detect_links"]  # x4 but 3 ms; +6 ms but x1.15
+    assert result["slowdowns"][0]["ratio"] == 2.0
+    assert [e["rule"] for e in result["speedups"]] == ["detect_tables_merged_empty"]
+    assert diff(base, cand, slowdown=1.1, min_ms=5.0)["slowdowns"][1]["rule"] == "ensure_title_bytes"
+    assert [e["rule"] for e in diff(base, cand, slowdown=1.25, min_ms=2.0)["slowdowns"]] == \
+        ["detect_links", "detect_contrast"]  # totals are +3 ms but only x1.03
+
+
+def test_documents_failing_in_both_versions_are_listed_not_changed():
+    docs = {"broken.docx": outcome(status=400)}
+    result = diff(docs, copy.deepcopy(docs))
+
+    assert result["behaviorChanges"] == []
+    assert result["failingInBoth"] == [
+        {"doc": "broken.docx", "endpoint": "upload-document", "error": None},
+        {"doc": "broken.docx", "endpoint": "download-document", "error": "invalid docx"},
+    ]
+    out = io.StringIO()
+    replay.print_summary({"baseline": "HEAD", "candidate": "work", **result}, file=out)
+    assert "Failing in both versions: 2" in out.getvalue()
+
+
+def test_instrument_times_rules_and_the_detectors_registry():
+    module = types.ModuleType("fake_server")
+
+    def detect_links(doc):
+        return ["link"]
+
+    def helper():
+        return "untimed"
+
+    module.detect_links = detect_links
+    module.helper = helper
+    module.DETECTORS = [("links", False, detect_links), ("other", False, helper)]
+    timings = {}
+    replay._instrument(module, timings)
+
+    name, needs_doc, wrapped = module.DETECTORS[0]
+    assert (name, needs_doc) == ("links", False) and wrapped is module.detect_links and wrapped is not detect_links
+    assert wrapped.__name__ == "detect_links"
+    assert module.DETECTORS[1][2] is helper
+    assert wrapped(None) == ["link"] and module.detect_links(None) == ["link"]
+    assert timings["detect_links"]["calls"] == 2 and timings["detect_links"]["ms"] >= 0
+    assert "helper" not in timings
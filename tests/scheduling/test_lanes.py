@@ -0,0 +1,94 @@
+"""
+Tests for cost-based lane routing and the lane admission gate (python-server/server.py,
+SCHEDULING section).
+
+Run with:  python -m pytest tests/scheduling
+"""
+import asyncio
+import io
+import zipfile
+
+import pytest
+
+import server
+
+
+def package(members) -> bytes:
+    buf = io.BytesIO()
+    with zipfile.ZipFile(buf, "w", zipfile.ZIP_STORED) as zf:
+        for name, size in members.items():
+            zf.writestr(name, b"x" * size)
+    return buf.getvalue()
+
+
+def test_cost_counts_document_xml_passes_and_parts():
+    cost = server.estimate_processing_cost(package({"word/document.xml": 1000, "word/styles.xml": 500, "word/media/a.png": 200}))
+
+    assert cost["documentXmlBytes"] == 1000
+    assert cost["xmlBytes"] == 1500
+    assert cost["mediaBytes"] == 200
+    assert cost["cost"] == 1500 + 200 + server.DOCUMENT_XML_EXTRA_PASSES * 1000 + server.PART_OVERHEAD_BYTES * 3
+
+
+def test_large_documents_go_to_the_heavy_lane(monkeypatch):
+    monkeypatch.setattr(server, "HEAVY_LANE_THRESHOLD_MB", 1)
+    small = server.estimate_processing_cost(package({"word/document.xml": 1000}))
+    big = server.estimate_processing_cost(package({"word/document.xml": 1000, "word/media/a.png": 2**20}))
+
+    assert server.choose_lane(small).name == "fast"
+    assert server.choose_lane(big).name == "heavy"
+
+
+def test_invalid_package_is_rejected():
+    with pytest.raises(server.HTTPException) as exc:
+        server.estimate_processing_cost(b"not a zip")
+    assert exc.value.status_code == 400
+
+
+def test_memory_budget_holds_requests_until_memory_is_released():
+    async def scenario():
+        lane = server.Lane("test", concurrency=4, memory_budget=10)
+        await lane.acquire(6)
+        second = asyncio.ensure_future(lane.acquire(6))
+        await asyncio.sleep(0)
+        queued = not second.done() and lane.stats()["queued"] == 1
+        lane.release(6)
+        await second
+        return queued, lane.active, lane.memory_in_use
+
+    assert asyncio.run(scenario()) == (True, 1, 6)
+
+
+def test_oversized_request_is_admitted_only_when_the_lane_is_idle():
+    async def scenario():
+        lane = server.Lane("test", concurrency=4, memory_budget=10)
+        await lane.acquire(1)
+        oversized = asyncio.ensure_future(lane.acquire(50))
+        await asyncio.sleep(0)
+        waited = not oversized.done()
+        lane.release(1)
+        await oversized
+        return waited, lane.active
+
+    assert asyncio.run(scenario()) == (True, 1)
+    assert asyncio.run(server.Lane("idle", 1, 10).acquire(50)) >= 0  # idle lane: admitted at once
+
+
+@pytest.mark.parametrize("release_first", [False, True])
+def test_cancelling_a_queued_request_leaves_the_lane_consistent(release_first):
+    async def scenario():
+        lane = server.Lane("test", concurrency=1, memory_budget=10)
+        await lane.acquire(1)
+        queued = asyncio.ensure_future(lane.acquire(1))
+        await asyncio.sleep(0)
+        queued.cancel()
+        if release_first:
+            lane.release(1)  # _wake() runs before the cancelled waiter gets to clean up
+        with pytest.raises(asyncio.CancelledError):
+            await queued
+        if not release_first:
+            lane.release(1)
+        await asyncio.wait_for(lane.acquire(1), 1)  # the lane still admits new work
+        return lane.active, lane.stats()["queued"]
+
+    assert asyncio.run(scenario()) == (1, 0)